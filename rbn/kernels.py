@@ -0,0 +1,110 @@
+# kernels holds the numba compiled loops used by Network. numba is optional; when it is
+# not installed the kernels are left as plain python functions and Network falls back to
+# its NumPy implementation instead of calling them.
+import numpy as np
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+    prange = range
+
+
+@njit(parallel=True, cache=True)
+def pack_bits(states, state_bits):
+    # pack_bits packs the uint8 states into 64-bit words where the state of node n is
+    # bit n & 63 of word n >> 6.
+    for w in prange(len(state_bits)):
+        word = np.uint64(0)
+        for b in range(min(64, len(states) - w * 64)):
+            word |= np.uint64(states[w * 64 + b]) << np.uint64(b)
+        state_bits[w] = word
+
+
+@njit(inline="always")
+def get_bit(state_bits, node):
+    # get_bit returns the state of node from the packed state_bits.
+    return np.int64((state_bits[node >> 6] >> np.uint64(node & 63)) & np.uint64(1))
+
+
+@njit(parallel=True, cache=True)
+def step(state_bits, new_states, indptr, indices, rule_flat, rule_offset):
+    # step writes the next state of every node into new_states. Each node walks its own
+    # slice of the CSR dependencies, packs the dependency states read from state_bits into
+    # an index with dependency j contributing bit j and looks the result up in its truth table.
+    for i in prange(len(new_states)):
+        base = indptr[i]
+        truth_index = 0
+        for j in range(indptr[i + 1] - base):
+            truth_index |= get_bit(state_bits, indices[base + j]) << j
+        new_states[i] = rule_flat[rule_offset[i] + truth_index]
+
+
+@njit(cache=True)
+def pack_frame(states, frame):
+    # pack_frame packs the uint8 states into the bytes of frame with the first node in the
+    # most significant bit, matching np.packbits.
+    for b in range(len(frame)):
+        byte = 0
+        for k in range(min(8, len(states) - b * 8)):
+            byte |= states[b * 8 + k] << (7 - k)
+        frame[b] = byte
+
+
+@njit(cache=True)
+def run_block(states, new_states, state_bits, indptr, indices, rule_flat, rule_offset, frames_out, t0, num_steps):
+    # run_block performs num_steps transitions of step in a single call so that Python is only
+    # re-entered once per block. After each step the states are packed into row t0 + t of
+    # frames_out. The two state buffers are swapped every step, so the final states are in
+    # new_states when num_steps is odd and in states otherwise.
+    for t in range(num_steps):
+        pack_bits(states, state_bits)
+        step(state_bits, new_states, indptr, indices, rule_flat, rule_offset)
+        states, new_states = new_states, states
+        pack_frame(states, frames_out[t0 + t])
+
+
+@njit(inline="always")
+def fixed_k_truth_index(state_bits, indices, node, k):
+    # fixed_k_truth_index packs the dependency states of node into its truth table index for
+    # a network where every node has exactly k dependencies, indices[node*k:(node+1)*k].
+    base = node * k
+    truth_index = 0
+    for j in range(k):
+        truth_index |= get_bit(state_bits, indices[base + j]) << j
+    return truth_index
+
+
+def _make_step_fixed_k(k):
+    # _make_step_fixed_k builds the step and block kernels for networks where every node has
+    # exactly k dependencies. A node's truth table then starts at i << k, so neither indptr nor
+    # rule_offset are read. k is a compile time constant which lets the inner loop be fully
+    # unrolled. The signatures match step and run_block so the kernels are interchangeable.
+    # The block kernel repeats the step loop instead of calling step_fixed_k because numba
+    # cannot load a cached function that calls a closure dispatcher, so it would be
+    # recompiled on every run.
+    @njit(parallel=True, cache=True)
+    def step_fixed_k(state_bits, new_states, indptr, indices, rule_flat, rule_offset):
+        for i in prange(len(new_states)):
+            new_states[i] = rule_flat[(i << k) | fixed_k_truth_index(state_bits, indices, i, k)]
+
+    @njit(parallel=True, cache=True)
+    def run_block_fixed_k(states, new_states, state_bits, indptr, indices, rule_flat, rule_offset, frames_out, t0, num_steps):
+        for t in range(num_steps):
+            pack_bits(states, state_bits)
+            for i in prange(len(new_states)):
+                new_states[i] = rule_flat[(i << k) | fixed_k_truth_index(state_bits, indices, i, k)]
+            states, new_states = new_states, states
+            pack_frame(states, frames_out[t0 + t])
+
+    return step_fixed_k, run_block_fixed_k
+
+
+# STEP_FIXED_K maps the common fixed dependency counts of NK models to their specialized
+# (step, run_block) kernel pairs.
+STEP_FIXED_K = {k: _make_step_fixed_k(k) for k in range(2, 7)}
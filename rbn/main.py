@@ -1,16 +1,9 @@
 from PIL import Image
 import math
 
-from network import Network, edge_algorithm_uniform
-
-def generate_image_slice(node_states: list[int]):
-    return [0 if node_state == 0 else 255 for node_state in node_states]
-
-
-def write_image_slice(column, pixels, node_states):
-    for pixel_row, pixel_value in enumerate(generate_image_slice(node_states)):
-        pixels[column, pixel_row] = pixel_value
+import numpy as np
 
+from network import Network, edge_algorithm_uniform
 
 def get_disturbance_time_slices(
     num_disturbances: int,
@@ -33,21 +26,32 @@ def generate_image(
 ):
     width = num_transitions
     height = network.num_nodes
-    image = Image.new("L", (width, height))
-    pixels = image.load()
+    # Each row of frames holds the node states of one time slice packed 8 to a byte. They are
+    # only expanded to 0 or 255 pixels when the image is saved.
+    frames = np.empty((width, (height + 7) // 8), dtype=np.uint8)
     # Write first state
-    write_image_slice(0, pixels, network.node_states)
+    frames[0] = np.packbits(network.states)
     disturbance_times = None
     if num_disturbances != 0:
         disturbance_times = get_disturbance_time_slices(num_disturbances, total_time_slices=num_transitions)
     print("Disturbance times: ", disturbance_times)
-    for i in range(num_transitions):
-        if disturbance_times is not None and i in disturbance_times:
-            print("INTRODUCING DISTURBANCE")
-            network.introduce_disturbance(disturbance_factor)
-        network.transition_state()
-        write_image_slice(column=i, pixels=pixels, node_states=network.node_states)
+    # The simulation is split into segments at the disturbance times. Each segment is run as
+    # one block and a disturbance is introduced between consecutive segments. Repeated
+    # disturbance times are collapsed so that a time slice is disturbed at most once.
+    boundaries = [0] + sorted(set(disturbance_times or [])) + [num_transitions]
+    network.run_transitions(boundaries[1] - boundaries[0], frames, start_row=boundaries[0])
+    for segment_start, segment_end in zip(boundaries[1:-1], boundaries[2:]):
+        print("INTRODUCING DISTURBANCE")
+        network.introduce_disturbance(disturbance_factor)
+        network.run_transitions(segment_end - segment_start, frames, start_row=segment_start)
     
+    # The frames are expanded in place in their (width, height) layout, where every row is
+    # contiguous, and transposed with a single copy. pixels is then C-contiguous with one row
+    # per node so PIL can read it as a raw "L" buffer without copying.
+    pixels_t = np.unpackbits(frames, axis=1, count=height)
+    pixels_t *= np.uint8(255)
+    pixels = pixels_t.T.copy()
+    image = Image.frombuffer("L", (width, height), pixels, "raw", "L", 0, 1)
     image.save("myimage.bmp")
 
 
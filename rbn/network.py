@@ -1,6 +1,8 @@
 from collections.abc import Callable
-import itertools
-import random
+
+import numpy as np
+
+from kernels import NUMBA_AVAILABLE, STEP_FIXED_K, pack_bits, run_block, step
 
 class Network:
     # A Network captures:
@@ -8,112 +10,164 @@ class Network:
     # 2. The directed edges between nodes.
     # 3. For each node, the boolean truth table where inputs are current state of dependency
     #    nodes and outputs are whether the node turns on or off.
-    # 1. Is captured with a list of ints like [0, 1, 1, 0, 0]
-    # 2. Is captured with dict[int, list[int]] like:
-    #    {0: [1], 1: [1], 2: [0, 3], 3: [2, 0]}
-    # 3. Is captured with a truth table dictionary where the keys are string-representations of
-    #    binary inputs like:
-    #    {"000": 0, "001": 0, "010": 1, "011": "0", "100": 1, "101": 1, "110": 1", "111": 0}
+    # 1. Is captured with a np.uint8 array like [0, 1, 1, 0, 0]. Two such arrays are allocated up
+    #    front and states always points at one of them; each update writes into the other one.
+    #    The numba transition also packs the states into 64-bit words, state_bits, before
+    #    gathering dependencies so that the gathered working set is 8x smaller.
+    # 2. Is captured in CSR form where the dependencies of node i are
+    #    dep_indices[dep_indptr[i]:dep_indptr[i+1]]. For the edges 1->0, 1->1, 0->2, 3->2, 2->3, 0->3
+    #    this is:
+    #    dep_indptr = [0, 1, 2, 4, 6], dep_indices = [1, 1, 0, 3, 2, 0]
+    #    which is also padded into an (N, K_max) array of dependencies with 0 filling unused slots:
+    #    [[1, 0], [1, 0], [0, 3], [2, 0]]
+    # 3. Is captured with a single flat np.uint8 rule array holding every node's truth table
+    #    back to back, and an offset array where node i's table starts at rule_offset[i].
+    #    A table is indexed by the integer formed from the dependency states, with dependency j
+    #    contributing bit j. For the dependencies above, the rules could be:
+    #    rule_flat = [0, 1, 1, 0, 0, 1, 1, 0, 1, 0, 0, 1], rule_offset = [0, 2, 4, 8, 12]
     # The ratio of 0 to 1 outputs are dictated by the node_rule_activation_probability.
     def __init__(
         self,
         num_nodes,
         num_edges,
-        edge_algorithm: Callable[[int, int], dict[int, list]],
+        edge_algorithm: Callable[[int, int, np.random.Generator], tuple[np.ndarray, np.ndarray]],
         node_rule_activation_probability: float = 0.5,
-        initial_state_probability: float = 0.5
+        initial_state_probability: float = 0.5,
+        seed: int | None = None
     ):
+        # All randomness of the network, from edge generation to disturbances, is drawn from a
+        # single generator so that a seed reproduces an entire run.
         self.num_nodes = num_nodes
         self.num_edges = num_edges
-        self.node_dependency_lists = Network._cleanup_adjacency(edge_algorithm(num_nodes, num_edges))
-        self.node_transition_rules = self._generate_rules(node_rule_activation_probability)
-        self.node_states = [0 for _ in range(num_nodes)]
+        self.rng = np.random.default_rng(seed)
+        self.dep_indptr, self.dep_indices = Network._cleanup_adjacency(*edge_algorithm(num_nodes, num_edges, self.rng))
+        self.deps = Network._pad_dependencies(self.dep_indptr, self.dep_indices)
+        self.pow2 = 1 << np.arange(self.deps.shape[1], dtype=np.int64)
+        self.truth_mask = (1 << np.diff(self.dep_indptr).astype(np.int64)) - 1
+        self.rule_flat, self.rule_offset = self._generate_rules(node_rule_activation_probability)
+        self._step_kernel, self._run_block = Network._select_step_kernel(np.diff(self.dep_indptr))
+        # The state buffers are left uninitialized as initialize_state writes the first states.
+        self._state_a = np.empty(num_nodes, dtype=np.uint8)
+        self._state_b = np.empty_like(self._state_a)
+        self.states = self._state_a
+        self.state_bits = np.empty((num_nodes + 63) // 64, dtype=np.uint64)
         self.initialize_state(initial_state_probability)
-    
+
+
+    @property
+    def node_states(self) -> list[int]:
+        # node_states returns the current node states as a list of ints.
+        return self.states.tolist()
+
+
+    def _back_buffer(self) -> np.ndarray:
+        # _back_buffer returns the state buffer which states is not pointing at so that an
+        # update can be written into it without allocating.
+        return self._state_b if self.states is self._state_a else self._state_a
+
+
     def _generate_rules(
         self,
         node_rule_activation_probability: float = 0.5
     ):
         # _generate_rules generates the truth table mapping for each node
         # which accepts an input of all nodes which it depends on and outputs the truth
-        # value.
-        node_rules = []
-        for _, adjacent_nodes in self.node_dependency_lists.items():
-            truth_keys = [
-                Network._create_truth_key(truth_inputs)
-                for truth_inputs in Network._generate_base_truth_inputs(len(adjacent_nodes))
-            ]
-            node_rule = Network._assign_truth_mapping(truth_keys, node_rule_activation_probability)
-            node_rules.append(node_rule)
-        return node_rules
+        # value. The truth tables of all nodes are concatenated into one flat array and
+        # returned along with the offset of each node's table. Every output of every table is
+        # drawn in a single call.
+        table_sizes = 2 ** np.diff(self.dep_indptr).astype(np.int64)
+        rule_offset = np.concatenate([[0], np.cumsum(table_sizes)])
+        rule_flat = (self.rng.random(rule_offset[-1]) < node_rule_activation_probability).astype(np.uint8)
+        return rule_flat, rule_offset
     
 
     @staticmethod
-    def _assign_truth_mapping(
-        truth_keys: list[str],
-        node_rule_activation_probability: float
-    ):
-        # _assign_truth_mapping accepts a list of truth_keys which are the string representation of
-        # truth table input values and an edge_transition_probability. It returns a mapping of
-        # truth table inputs to truth table outputs where the probability of transition to on is dictated by
-        # the node_rule_activation_probability. 
-        return {
-            truth_key: random.choices([0, 1], weights=[1 - node_rule_activation_probability, node_rule_activation_probability])[0]
-            for truth_key in truth_keys
-        }
+    def _cleanup_adjacency(indptr: np.ndarray, indices: np.ndarray):
+        # _cleanup_adjacency finds all nodes which are not adjacent to anything and sets
+        # them adjacent to themselves. The CSR arrays are returned with the new self edges
+        # inserted at the start of each isolated node's slice.
+        is_isolated = np.diff(indptr) == 0
+        isolated_nodes = np.flatnonzero(is_isolated).astype(np.int32)
+        new_indices = np.insert(indices, indptr[isolated_nodes], isolated_nodes)
+        new_indptr = (indptr + np.concatenate([[0], np.cumsum(is_isolated)])).astype(np.int32)
+        return new_indptr, new_indices
 
 
     @staticmethod
-    def _generate_base_truth_inputs(num_inputs: int) -> list[tuple[int]]:
-        # _generate_base_truth_inputs generates the boolean inputs of a truth
-        # table for num_inputs. For a 2-input table, the result would be
-        # [(0, 0), (0, 1), (1, 0), (1, 1)]
-        return list(itertools.product([0, 1], repeat=num_inputs))
+    def _pad_dependencies(indptr: np.ndarray, indices: np.ndarray):
+        # _pad_dependencies packs the CSR dependencies into an (N, K_max) array where unused
+        # slots are 0. The bits gathered from unused slots land above bit K_i of a node's truth
+        # index and are dropped with the truth_mask.
+        degrees = np.diff(indptr)
+        deps = np.zeros((len(degrees), degrees.max()), dtype=np.int32)
+        rows = np.repeat(np.arange(len(degrees)), degrees)
+        deps[rows, np.arange(len(indices)) - indptr[rows]] = indices
+        return deps
 
-    
-    @staticmethod
-    def _create_truth_key(truth_inputs: list[int]):
-        # _create_truth_key creates a string representation of a list of
-        # ints. This is intended to be used for truth table map creation.
-        # Given an input like [0, 1, 0], returns: "010"
-        return ''.join(str(i) for i in truth_inputs)
-    
 
     @staticmethod
-    def _cleanup_adjacency(adjacency_list: dict[int, list]):
-        # _cleanup_adjacency finds all nodes which are not adjacent to anything and sets
-        # them adjacent to themselves.
-        new_adjacency_list = {}
-        for node, adjacent_nodes in adjacency_list.items():
-            if not adjacent_nodes:
-                adjacent_nodes = [node]
-            new_adjacency_list[node] = adjacent_nodes
-        return new_adjacency_list
+    def _select_step_kernel(degrees: np.ndarray):
+        # _select_step_kernel picks the numba step kernel for the dependency counts. When every
+        # node has the same number of dependencies and a specialized kernel exists for it, that
+        # kernel is used. Otherwise the general CSR kernel is used. The step kernel is returned
+        # along with its matching block kernel.
+        if degrees.min() == degrees.max():
+            return STEP_FIXED_K.get(int(degrees[0]), (step, run_block))
+        return step, run_block
 
 
     def initialize_state(self, probability_of_on: float = 0.5):
         # initialize_state creates the first list of node states randomly based on the probability_of_on.
-        new_states = []
-        for _ in range(self.num_nodes):
-            is_on = random.choices([0, 1], weights=[1 - probability_of_on, probability_of_on])[0]
-            new_states.append(is_on)
-        self.node_states = new_states
-    
-
-    def _get_dependency_node_states(self, dependency_nodes: list[int]):
-        # get_dependency_node_states returns the state of the nodes from the dependency_nodes list.
-        return [self.node_states[n] for n in dependency_nodes]
+        new_states = self._back_buffer()
+        new_states[:] = self.rng.random(self.num_nodes) < probability_of_on
+        self.states = new_states
 
 
     def transition_state(self):
-        # transition_state uses the current node_state and the node_transition_rules to change
-        # the node_states.
-        new_node_states = []
-        for node_key, adjacent_nodes in self.node_dependency_lists.items():
-            node_rule_map = self.node_transition_rules[node_key]
-            truth_key = Network._create_truth_key(self._get_dependency_node_states(adjacent_nodes))
-            new_node_states.append(node_rule_map[truth_key])
-        self.node_states = new_node_states
+        # transition_state uses the current states and the rule_flat to change the states.
+        # The new states are written into the back buffer. With numba the selected step kernel
+        # walks the CSR dependencies of the packed state_bits. Otherwise the dependency states of
+        # every node are gathered at once, packed into an index of the node's truth table and
+        # looked up in a single vectorized step.
+        new_states = self._back_buffer()
+        if NUMBA_AVAILABLE:
+            pack_bits(self.states, self.state_bits)
+            self._step_kernel(self.state_bits, new_states, self.dep_indptr, self.dep_indices, self.rule_flat, self.rule_offset)
+        else:
+            truth_indices = (self.states[self.deps] @ self.pow2) & self.truth_mask
+            np.take(self.rule_flat, self.rule_offset[:-1] + truth_indices, out=new_states)
+        self.states = new_states
+
+
+    def run_transitions(
+        self,
+        num_transitions: int,
+        frames: np.ndarray,
+        start_row: int = 0
+    ):
+        # run_transitions calls transition_state num_transitions times and writes each new state
+        # bit-packed with np.packbits into the rows of the (num_time_slices, ceil(num_nodes / 8))
+        # frames array starting at start_row. With numba the whole block runs in one kernel call.
+        if not NUMBA_AVAILABLE:
+            for t in range(num_transitions):
+                self.transition_state()
+                frames[start_row + t] = np.packbits(self.states)
+            return
+        new_states = self._back_buffer()
+        self._run_block(
+            self.states,
+            new_states,
+            self.state_bits,
+            self.dep_indptr,
+            self.dep_indices,
+            self.rule_flat,
+            self.rule_offset,
+            frames,
+            start_row,
+            num_transitions
+        )
+        if num_transitions % 2 == 1:
+            self.states = new_states
     
 
     def introduce_disturbance(
@@ -121,56 +175,64 @@ class Network:
         disturbance_probability: float = 0.2
     ):
         # introduce_disturbance conditionally inverts node states. A node state is inverted
-        # if the a random disturbance_probability is calculated to be true.
-        new_node_states = []
-        for node_state in self.node_states:
-            value = node_state
-            should_invert = random.choices([0, 1], weights=[1 - disturbance_probability, disturbance_probability])[0]
-            if should_invert:
-                new_node_states.append(0 if value == 1 else 1)
-            else:
-                new_node_states.append(value)
-        self.node_states = new_node_states
+        # if the a random disturbance_probability is calculated to be true. All nodes are
+        # inverted at once by XOR-ing the states with a random mask.
+        self.states ^= (self.rng.random(self.num_nodes) < disturbance_probability).view(np.uint8)
     
 
     def print_stats(self):
-        print("Total Number of Edges: ", sum(len(nodes) for nodes in self.node_dependency_lists.values()))
-        print("Highest number of Edges: ", max(len(nodes) for nodes in self.node_dependency_lists.values()))
+        print("Total Number of Edges: ", len(self.dep_indices))
+        print("Highest number of Edges: ", np.diff(self.dep_indptr).max())
+
+
+def edges_to_csr(
+    num_nodes: int,
+    from_nodes: np.ndarray,
+    to_nodes: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    # edges_to_csr converts the directed edges from_nodes[e] -> to_nodes[e] into the CSR
+    # arrays (indptr, indices) where the dependencies of node i are indices[indptr[i]:indptr[i+1]].
+    # Dependencies keep the order in which their edges were given.
+    indptr = np.zeros(num_nodes + 1, dtype=np.int32)
+    np.cumsum(np.bincount(to_nodes, minlength=num_nodes), out=indptr[1:])
+    indices = from_nodes[np.argsort(to_nodes, kind="stable")].astype(np.int32)
+    return indptr, indices
 
 
 def edge_algorithm_uniform(
     num_nodes: int,
-    num_edges: int
-) -> dict[int, list]:
+    num_edges: int,
+    rng: np.random.Generator | None = None
+) -> tuple[np.ndarray, np.ndarray]:
     # Given a number of nodes and a desired number of edges,
     # generate edges randomly such that each edge has 0/num_nodes
     # probability of being attached to any node.
     # Note that there is a potential for a node not to be adjacent to anything.
-    adjacency_list = {
-        i: []
-        for i in range(num_nodes)
-    }
-    edges = set()
+    if rng is None:
+        rng = np.random.default_rng()
+    # edges are directional with "from" node coming first and are encoded as
+    # node0 -> node1 == node0 * num_nodes + node1
+    # Nodes only need to know about their inputs and not who they are outputting to.
+    edges = np.empty(0, dtype=np.int64)
     while len(edges) < num_edges:
-        # edges are directional with "from" node coming first.
-        # node0 -> node1 == (node0, node1)
-        # Nodes only need to know about their inputs and not who they are outputting to.
-        node0 = random.randint(0, num_nodes-1)
-        node1 = random.randint(0, num_nodes-1)
+        # Candidate edges are drawn in batches and duplicates are dropped, keeping the
+        # first occurrence so that edges stay in the order they were drawn.
         # nodes can connect to themselves
-        edge = tuple((node0, node1))
-        if edge not in edges:
-            edges.add(edge)
-            adjacency_list[node1].append(node0)
-    return adjacency_list
+        candidates = rng.integers(0, num_nodes, size=(2 * (num_edges - len(edges)), 2), dtype=np.int64)
+        edges = np.concatenate([edges, candidates[:, 0] * num_nodes + candidates[:, 1]])
+        _, first_seen = np.unique(edges, return_index=True)
+        edges = edges[np.sort(first_seen)]
+    edges = edges[:num_edges]
+    return edges_to_csr(num_nodes, edges // num_nodes, edges % num_nodes)
 
 
 # TODO
 # def edge_algorithm_affinity(
 #     num_nodes: int,
 #     num_edges: int,
-#     affinity_factor: float
-# ) -> dict[int, list]:
+#     affinity_factor: float,
+#     rng: np.random.Generator | None = None
+# ) -> tuple[np.ndarray, np.ndarray]:
 #     # Given a number of nodes, desired number of edges, and an affinity factor,
 #     # generate edges such that each edge has a higher likelihood of being connected
 #     # to a node from which many edges connect to based on the affinity factor.